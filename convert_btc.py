@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+
+def convert_btc_csv(csv_path: Path, parquet_path: Path) -> int:
+    table = pv.read_csv(
+        csv_path,
+        convert_options=pv.ConvertOptions(
+            include_columns=["Timestamp", "Close"],
+            column_types={"Timestamp": pa.float64(), "Close": pa.float64()},
+        ),
+    )
+    table = table.drop_null()
+    timestamps = pc.cast(table["Timestamp"], pa.int64())
+    table = pa.table({"Timestamp": timestamps, "Close": table["Close"]})
+    table = table.sort_by("Timestamp")
+
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(table, parquet_path, row_group_size=100_000, compression="zstd")
+    return table.num_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert the BTC 1-min CSV to Parquet for the Streamlit app."
+    )
+    parser.add_argument(
+        "--input",
+        type=Path,
+        default=Path("data/btcusd_1-min_data.csv"),
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("data/btcusd_1-min_data.parquet"),
+    )
+    args = parser.parse_args()
+
+    if not args.input.exists():
+        raise RuntimeError(f"Missing BTC CSV file: {args.input}")
+
+    rows = convert_btc_csv(args.input, args.output)
+    print(f"Wrote {rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,25 @@
 from __future__ import annotations
 
 import argparse
+import functools
+import hashlib
+import inspect
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 from pathlib import Path
-from typing import Iterable
+from typing import Callable, Iterable
 
+import numpy as np
+import orjson
 import pandas as pd
 import requests
 from dune_client.client import DuneClient
 from dune_client.query import QueryBase
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 FRED_BASE = "https://api.stlouisfed.org/fred/series/observations"
 FRED_SERIES = {
@@ -18,46 +28,93 @@ FRED_SERIES = {
     "DGS5": "yield_5y",
     "DGS10": "yield_10y",
 }
+FRED_PAGE_LIMIT = 100000
+FRED_MAX_WORKERS = 8
+CACHE_DIR = Path.home() / ".cache" / "crypto_us_yields"
+CACHE_TTL_SECONDS = 24 * 60 * 60
+CACHE_VERSION = 2
 
 
-def pick_column(df: pd.DataFrame, preferred: Iterable[str], required_terms: Iterable[str]) -> str | None:
+def cache_path(name: str, *key_parts: object) -> Path:
+    digest = hashlib.sha256(repr(key_parts).encode()).hexdigest()[:16]
+    return CACHE_DIR / f"{name}_v{CACHE_VERSION}_{digest}.parquet"
+
+
+def cache_is_fresh(path: Path) -> bool:
+    return path.exists() and path.stat().st_mtime >= time.time() - CACHE_TTL_SECONDS
+
+
+def write_cache(df: pd.DataFrame, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(path, compression="zstd")
+
+
+def disk_cache(
+    name: str, key_args: Iterable[str]
+) -> Callable[[Callable[..., pd.DataFrame]], Callable[..., pd.DataFrame]]:
+    key_args = list(key_args)
+
+    def decorator(func: Callable[..., pd.DataFrame]) -> Callable[..., pd.DataFrame]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args: object, **kwargs: object) -> pd.DataFrame:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            path = cache_path(name, *(bound.arguments[arg] for arg in key_args))
+            if cache_is_fresh(path):
+                print(f"{name} cache hit: {path}")
+                return pd.read_parquet(path)
+            df = func(*args, **kwargs)
+            write_cache(df, path)
+            return df
+
+        return wrapper
+
+    return decorator
+
+
+def pick_column(
+    lowered: dict[str, str], preferred: Iterable[str], required_terms: Iterable[str]
+) -> str | None:
+    columns = lowered.values()
     for name in preferred:
-        if name in df.columns:
+        if name in columns:
             return name
     required_terms = [term.lower() for term in required_terms]
     matches = [
         col
-        for col in df.columns
-        if all(term in col.lower() for term in required_terms)
+        for low, col in lowered.items()
+        if all(term in low for term in required_terms)
     ]
     if matches:
-        return sorted(matches, key=len)[0]
+        return min(matches, key=len)
     return None
 
 
-def pick_date_column(df: pd.DataFrame) -> str | None:
+def pick_date_column(lowered: dict[str, str]) -> str | None:
     preferred = ["date", "day", "dt", "timestamp", "block_date"]
+    columns = lowered.values()
     for name in preferred:
-        if name in df.columns:
+        if name in columns:
             return name
-    for col in df.columns:
-        lowered = col.lower()
-        if "date" in lowered or lowered.endswith("day"):
+    for low, col in lowered.items():
+        if "date" in low or low.endswith("day"):
             return col
     return None
 
 
 def maybe_convert_percent(series: pd.Series, label: str) -> pd.Series:
-    series = pd.to_numeric(series, errors="coerce")
-    max_val = series.dropna().abs().max()
-    if pd.isna(max_val):
-        return series
-    if max_val <= 1.5:
-        print(f"{label} looks like decimal; converting to percent.")
-        return series * 100
-    return series
+    values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=float, copy=True)
+    if values.size:
+        max_val = max(np.fmax.reduce(values), -np.fmin.reduce(values))
+        if max_val <= 1.5:
+            print(f"{label} looks like decimal; converting to percent.")
+            np.multiply(values, 100.0, out=values)
+    return pd.Series(values, index=series.index, name=series.name)
 
 
+@disk_cache("aave", key_args=["query_id"])
 def fetch_aave_apy(dune_api_key: str, query_id: int) -> pd.DataFrame:
     dune = DuneClient(dune_api_key)
     query = QueryBase(query_id=query_id)
@@ -67,14 +124,15 @@ def fetch_aave_apy(dune_api_key: str, query_id: int) -> pd.DataFrame:
     print(df.head(3))
     print(df.dtypes)
 
-    date_col = pick_date_column(df)
+    lowered = {col.lower(): col for col in df.columns}
+    date_col = pick_date_column(lowered)
     supply_col = pick_column(
-        df,
+        lowered,
         preferred=["aave_supply_apy", "supply_apy", "supply_apr", "supply_rate", "supply"],
         required_terms=["supply"],
     )
     borrow_col = pick_column(
-        df,
+        lowered,
         preferred=[
             "aave_borrow_apy",
             "borrow_apy",
@@ -89,7 +147,7 @@ def fetch_aave_apy(dune_api_key: str, query_id: int) -> pd.DataFrame:
     )
     if borrow_col is None:
         borrow_col = pick_column(
-            df,
+            lowered,
             preferred=["avg_variableRate", "variable_rate", "variable"],
             required_terms=["variable"],
         )
@@ -110,90 +168,189 @@ def fetch_aave_apy(dune_api_key: str, query_id: int) -> pd.DataFrame:
     )
     out["date"] = (
         pd.to_datetime(out["date"], errors="coerce", utc=True)
-        .dt.tz_convert(None)
-        .dt.normalize()
+        .to_numpy(dtype="datetime64[ns]")
+        .astype("datetime64[D]")
+        .astype("datetime64[ns]")
     )
     out["aave_supply_apy"] = maybe_convert_percent(out["aave_supply_apy"], "aave_supply_apy")
     out["aave_borrow_apy"] = maybe_convert_percent(out["aave_borrow_apy"], "aave_borrow_apy")
 
-    return out.dropna(subset=["date"])
+    return out.dropna(subset=["date"]).sort_values("date", ignore_index=True)
 
 
-def fetch_fred_series(series_id: str, api_key: str, observation_start: str) -> pd.DataFrame:
-    limit = 100000
-    offset = 0
-    observations: list[dict[str, str]] = []
-    total_count = None
+def build_fred_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504)
+        ),
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_fred_page(
+    session: requests.Session,
+    series_id: str,
+    api_key: str,
+    observation_start: str,
+    offset: int,
+    limit: int,
+) -> dict:
+    params = {
+        "series_id": series_id,
+        "api_key": api_key,
+        "file_type": "json",
+        "observation_start": observation_start,
+        "offset": offset,
+        "limit": limit,
+    }
+    response = session.get(FRED_BASE, params=params, timeout=30)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+def fetch_fred_series(
+    series_id: str,
+    api_key: str,
+    observation_start: str,
+    session: requests.Session,
+    executor: ThreadPoolExecutor | None = None,
+) -> pd.DataFrame:
+    limit = FRED_PAGE_LIMIT
+    payload = fetch_fred_page(session, series_id, api_key, observation_start, 0, limit)
+    total_count = int(payload.get("count", 0))
+    print(
+        f"{series_id} count={total_count} offset={payload.get('offset')} "
+        f"limit={payload.get('limit')}"
+    )
 
-    while True:
-        params = {
-            "series_id": series_id,
-            "api_key": api_key,
-            "file_type": "json",
-            "observation_start": observation_start,
-            "offset": offset,
-            "limit": limit,
-        }
-        response = requests.get(FRED_BASE, params=params, timeout=30)
-        response.raise_for_status()
-        payload = response.json()
-
-        if total_count is None:
-            total_count = int(payload.get("count", 0))
-            print(
-                f"{series_id} count={total_count} offset={payload.get('offset')} "
-                f"limit={payload.get('limit')}"
-            )
+    offsets = range(limit, total_count, limit)
+    pages: list[list[dict[str, str]]] = [[] for _ in range(len(offsets) + 1)]
+    pages[0] = payload.get("observations", [])
+    print(f"{series_id} page offset=0 limit={limit} rows={len(pages[0])}")
+
+    if offsets:
+        pool = executor or ThreadPoolExecutor(max_workers=FRED_MAX_WORKERS)
+        try:
+            futures = {
+                pool.submit(
+                    fetch_fred_page,
+                    session,
+                    series_id,
+                    api_key,
+                    observation_start,
+                    offset,
+                    limit,
+                ): offset
+                for offset in offsets
+            }
+            for future in as_completed(futures):
+                offset = futures[future]
+                page_obs = future.result().get("observations", [])
+                pages[offset // limit] = page_obs
+                print(f"{series_id} page offset={offset} limit={limit} rows={len(page_obs)}")
+        finally:
+            if executor is None:
+                pool.shutdown()
+
+    total = sum(len(page) for page in pages)
+    print(f"{series_id} rows_collected={total}")
+    if not total:
+        return pd.DataFrame(
+            {"value": pd.Series(dtype=float)}, index=pd.DatetimeIndex([], name="date")
+        )
 
-        page_obs = payload.get("observations", [])
-        observations.extend(page_obs)
-        print(f"{series_id} page offset={offset} limit={limit} rows={len(page_obs)}")
+    dates = np.empty(total, dtype="U10")
+    values = np.empty(total, dtype=object)
+    for i, obs in enumerate(chain.from_iterable(pages)):
+        dates[i] = obs["date"]
+        values[i] = obs["value"]
 
-        if total_count is None or offset + limit >= total_count:
-            break
-        offset += limit
+    present = values != "."
+    parsed = np.full(total, np.nan)
+    parsed[present] = pd.to_numeric(values[present], errors="coerce")
+
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(dates, format="%Y-%m-%d", errors="coerce", cache=True),
+            "value": parsed,
+        }
+    ).set_index("date")
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index()
+    return df
 
-    print(f"{series_id} rows_collected={len(observations)}")
-    if not observations:
-        return pd.DataFrame(columns=["date", "value"])
 
-    df = pd.DataFrame(observations)[["date", "value"]]
-    df["date"] = (
-        pd.to_datetime(df["date"], errors="coerce", utc=True)
-        .dt.tz_convert(None)
-        .dt.normalize()
-    )
-    df["value"] = pd.to_numeric(df["value"].replace(".", pd.NA), errors="coerce")
-    df = df.sort_values("date")
+def fetch_fred_series_cached(
+    series_id: str,
+    api_key: str,
+    observation_start: str,
+    session: requests.Session,
+    executor: ThreadPoolExecutor | None = None,
+) -> pd.DataFrame:
+    path = cache_path("fred", series_id, observation_start)
+    if cache_is_fresh(path):
+        print(f"{series_id} cache hit: {path}")
+        return pd.read_parquet(path)
+
+    cached = pd.read_parquet(path) if path.exists() else None
+    if cached is None or cached.empty:
+        df = fetch_fred_series(series_id, api_key, observation_start, session, executor)
+    else:
+        next_start = (cached.index.max() + pd.Timedelta(days=1)).date().isoformat()
+        print(f"{series_id} cache stale; fetching from {next_start}")
+        fresh = fetch_fred_series(series_id, api_key, next_start, session, executor)
+        df = cached if fresh.empty else pd.concat([cached, fresh])
+    write_cache(df, path)
     return df
 
 
 def build_yield_frame(
-    api_key: str, observation_start: str
+    api_key: str, observation_start: str, session: requests.Session
 ) -> pd.DataFrame:
-    merged = None
-    for series_id, col_name in FRED_SERIES.items():
-        series_df = fetch_fred_series(series_id, api_key, observation_start)
-        max_date = series_df["date"].max()
+    with ThreadPoolExecutor(max_workers=FRED_MAX_WORKERS) as page_executor:
+        with ThreadPoolExecutor(max_workers=len(FRED_SERIES)) as series_executor:
+            series_frames = list(
+                series_executor.map(
+                    lambda series_id: fetch_fred_series_cached(
+                        series_id, api_key, observation_start, session, page_executor
+                    ),
+                    FRED_SERIES,
+                )
+            )
+
+    for series_id, series_df in zip(FRED_SERIES, series_frames):
+        max_date = series_df.index.max()
         null_count = series_df["value"].isna().sum()
         print(f"{series_id} max_date={max_date} nulls={null_count}")
+        if not series_df.index.is_unique:
+            raise ValueError(f"{series_id} has duplicate observation dates.")
 
-        series_df = series_df.rename(columns={"value": col_name})
-        if merged is None:
-            merged = series_df
-        else:
-            merged = merged.merge(series_df, on="date", how="outer")
-
-    if merged is None:
+    if not series_frames:
         return pd.DataFrame(columns=["date"] + list(FRED_SERIES.values()))
-    return merged.sort_values("date")
+    union = pd.DatetimeIndex(
+        np.unique(np.concatenate([series_df.index.values for series_df in series_frames])),
+        name="date",
+    )
+    values = np.full((len(union), len(series_frames)), np.nan)
+    for j, series_df in enumerate(series_frames):
+        rows = union.searchsorted(series_df.index.values)
+        values[rows, j] = series_df["value"].to_numpy(dtype=float)
+    merged = pd.DataFrame(values, index=union, columns=list(FRED_SERIES.values()))
+    return merged.reset_index()
 
 
 def add_spreads(df: pd.DataFrame) -> pd.DataFrame:
-    for tenor in ["6m", "2y", "5y", "10y"]:
-        yield_col = f"yield_{tenor}"
-        df[f"supply_minus_yield_{tenor}"] = df["aave_supply_apy"] - df[yield_col]
-        df[f"borrow_minus_yield_{tenor}"] = df["aave_borrow_apy"] - df[yield_col]
+    tenors = ["6m", "2y", "5y", "10y"]
+    sides = ["supply", "borrow"]
+    yields = df[[f"yield_{tenor}" for tenor in tenors]].to_numpy(dtype=float)
+    rates = df[[f"aave_{side}_apy" for side in sides]].to_numpy(dtype=float)
+    spreads = rates[:, None, :] - yields[:, :, None]
+    cols = [f"{side}_minus_yield_{tenor}" for tenor in tenors for side in sides]
+    df[cols] = spreads.reshape(len(df), len(cols))
     return df
 
 
@@ -223,22 +380,20 @@ def main() -> None:
         raise RuntimeError("Dune query returned no rows.")
 
     start_date = aave_df["date"].min().date().isoformat()
-    yields_df = build_yield_frame(fred_api_key, start_date)
+    with build_fred_session() as session:
+        yields_df = build_yield_frame(fred_api_key, start_date, session)
 
-    joined_inner = aave_df.merge(yields_df, on="date", how="inner")
+    joined_inner = aave_df.merge(yields_df, on="date", how="inner", validate="many_to_one")
     print(f"Inner-joined rows: {len(joined_inner)}")
 
     if args.no_ffill_yields:
         joined = joined_inner
     else:
-        all_dates = pd.date_range(
-            start=aave_df["date"].min(), end=aave_df["date"].max(), freq="D"
-        )
-        yields_daily = (
-            yields_df.set_index("date").reindex(all_dates).sort_index().ffill()
-        )
-        yields_daily = yields_daily.reset_index().rename(columns={"index": "date"})
-        joined = aave_df.merge(yields_daily, on="date", how="left")
+        aave_dates = pd.DatetimeIndex(aave_df["date"].unique(), name="date")
+        yields_on_aave = (
+            yields_df.set_index("date").ffill().reindex(aave_dates, method="ffill")
+        ).reset_index()
+        joined = aave_df.merge(yields_on_aave, on="date", how="left", validate="many_to_one")
 
     joined = add_spreads(joined)
     print(f"Final rows: {len(joined)}")
@@ -250,8 +405,11 @@ def main() -> None:
             col_max = joined[col].max()
             print(f"{col} min={col_min} max={col_max}")
 
+    assert joined["date"].is_monotonic_increasing, "joined frame must be sorted by date"
     args.output.parent.mkdir(parents=True, exist_ok=True)
-    joined.to_parquet(args.output, index=False)
+    float_cols = joined.select_dtypes("float64").columns
+    joined[float_cols] = joined[float_cols].astype("float32")
+    joined.to_parquet(args.output, index=False, compression="zstd", use_dictionary=False)
     print(f"Wrote {len(joined)} rows to {args.output}")
 
 
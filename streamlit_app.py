@@ -4,83 +4,186 @@ from math import ceil, floor
 from pathlib import Path
 
 import altair as alt
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
 import streamlit as st
+from pandas.api.types import is_datetime64_any_dtype
 
 DATA_PATH = Path("data/crypto_us_yields.parquet")
-BTC_DATA_PATH = Path("data/btcusd_1-min_data.csv")
+BTC_CSV_PATH = Path("data/btcusd_1-min_data.csv")
+BTC_PARQUET_PATH = Path("data/btcusd_1-min_data.parquet")
+BTC_DATA_PATH = BTC_PARQUET_PATH if BTC_PARQUET_PATH.exists() else BTC_CSV_PATH
 
 
 def to_utc_ts(value: pd.Timestamp) -> int:
-    ts = pd.Timestamp(value)
-    if ts.tzinfo is None:
-        ts = ts.tz_localize("UTC")
-    else:
-        ts = ts.tz_convert("UTC")
-    return int(ts.timestamp())
+    return int(pd.Timestamp(value).timestamp())
+
+
+def read_btc_parquet(
+    parquet_path: Path, start_ts: int | None, end_ts: int | None
+) -> pd.DataFrame:
+    dataset = ds.dataset(parquet_path, format="parquet")
+    row_filter = None
+    if start_ts is not None:
+        row_filter = ds.field("Timestamp") >= start_ts
+    if end_ts is not None:
+        end_filter = ds.field("Timestamp") <= end_ts
+        row_filter = end_filter if row_filter is None else row_filter & end_filter
+    table = dataset.to_table(columns=["Timestamp", "Close"], filter=row_filter)
+    return table.to_pandas()
+
+
+def read_btc_csv(csv_path: Path, start_ts: int | None, end_ts: int | None) -> pd.DataFrame:
+    reader = pv.open_csv(
+        csv_path,
+        convert_options=pv.ConvertOptions(
+            include_columns=["Timestamp", "Close"],
+            column_types={"Timestamp": pa.float64(), "Close": pa.float64()},
+        ),
+    )
+    batches = []
+    for batch in reader:
+        timestamps = batch.column("Timestamp")
+        mask = pc.and_(pc.is_valid(timestamps), pc.is_valid(batch.column("Close")))
+        if start_ts is not None:
+            mask = pc.and_(mask, pc.greater_equal(timestamps, start_ts))
+        if end_ts is not None:
+            mask = pc.and_(mask, pc.less_equal(timestamps, end_ts))
+        batches.append(batch.filter(mask))
+    return pa.Table.from_batches(batches, schema=reader.schema).to_pandas()
+
+
+def grouped_median(keys: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    if keys.size == 0:
+        return keys, values.astype(float)
+    if not (keys[1:] >= keys[:-1]).all():
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        values = values[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], keys.size]
+    medians = np.array([np.median(values[start:end]) for start, end in zip(starts, ends)])
+    return keys[starts], medians
 
 
 @st.cache_data(show_spinner="Loading BTC price data...")
 def load_btc_daily_median(
-    csv_path: Path, start_ts: int | None, end_ts: int | None
+    data_path: Path, start_ts: int | None, end_ts: int | None
 ) -> pd.DataFrame:
-    usecols = ["Timestamp", "Close"]
-    df = pd.read_csv(csv_path, usecols=usecols)
-    df["Timestamp"] = pd.to_numeric(df["Timestamp"], errors="coerce")
-    df["Close"] = pd.to_numeric(df["Close"], errors="coerce")
-    df = df.dropna(subset=["Timestamp", "Close"])
+    if data_path.suffix == ".parquet":
+        df = read_btc_parquet(data_path, start_ts, end_ts)
+    else:
+        df = read_btc_csv(data_path, start_ts, end_ts)
+
+    days = (df["Timestamp"].to_numpy() // 86400).astype(np.int64)
+    day_keys, medians = grouped_median(days, df["Close"].to_numpy(dtype=float))
+    return pd.DataFrame(
+        {
+            "date": day_keys.astype("datetime64[D]").astype("datetime64[ns]"),
+            "median_price": medians,
+        }
+    )
 
-    if start_ts is not None:
-        df = df[df["Timestamp"] >= start_ts]
-    if end_ts is not None:
-        df = df[df["Timestamp"] <= end_ts]
 
-    df["date"] = (
-        pd.to_datetime(df["Timestamp"], unit="s", utc=True)
-        .dt.tz_convert(None)
-        .dt.normalize()
+@st.cache_data(show_spinner="Loading rate data...")
+def load_rates(parquet_path: Path, mtime: float) -> tuple[pd.DataFrame, pd.DataFrame]:
+    df = pd.read_parquet(parquet_path)
+    if "date" in df.columns and not is_datetime64_any_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"], errors="coerce")
+    if not df["date"].is_monotonic_increasing:
+        df = df.sort_values("date")
+    return df, df.set_index("date")
+
+
+@st.cache_data(max_entries=32)
+def rolling_mean(_series: pd.Series, mtime: float, name: str, window: int) -> np.ndarray:
+    return _series.rolling(window=window, min_periods=1).mean().to_numpy()
+
+
+@st.cache_data(max_entries=32)
+def melt_plot_frame(
+    _plot_df: pd.DataFrame, mtime: float, rate_type: str, tenor: str, ma_window: int
+) -> pd.DataFrame:
+    long_df = _plot_df.reset_index().melt(
+        id_vars="date", var_name="series", value_name="value"
     )
-    daily = (
-        df.groupby("date", as_index=False)["Close"]
-        .median()
-        .rename(columns={"Close": "median_price"})
+    return long_df.dropna(subset=["value"])
+
+
+def summarize_bins(bins: pd.Series, returns: pd.Series) -> pd.DataFrame:
+    bins = bins.astype("category")
+    codes = bins.cat.codes.to_numpy()
+    values = returns.to_numpy(dtype=float)
+    valid = (codes >= 0) & ~np.isnan(values)
+    codes = codes[valid]
+    values = values[valid]
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    values = values[order]
+    starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    ends = np.r_[starts[1:], codes.size]
+
+    records = []
+    for code, start, end in zip(codes[starts], starts, ends):
+        chunk = values[start:end]
+        p25, median, p75 = np.percentile(chunk, [25, 50, 75])
+        records.append(
+            {
+                "spread_bin": bins.cat.categories[code],
+                "median": median,
+                "p25": p25,
+                "p75": p75,
+                "win_rate": (chunk > 0).mean(),
+                "count": chunk.size,
+            }
+        )
+    return pd.DataFrame.from_records(
+        records, columns=["spread_bin", "median", "p25", "p75", "win_rate", "count"]
     )
-    return daily.sort_values("date")
 
 
 def add_forward_returns(daily_df: pd.DataFrame, forward_days: int) -> pd.DataFrame:
     out = daily_df.sort_values("date").copy()
-    out["forward_return"] = (
-        out["median_price"].shift(-forward_days) / out["median_price"] - 1
-    )
+    prices = out["median_price"].to_numpy(dtype=float)
+    forward = np.empty_like(prices)
+    forward[:-forward_days] = prices[forward_days:] / prices[:-forward_days] - 1.0
+    forward[-forward_days:] = np.nan
+    out["forward_return"] = forward
     return out
 
 
 def build_fixed_width_bins(series: pd.Series, width: float) -> pd.Series:
-    clean = pd.to_numeric(series, errors="coerce").dropna()
-    if clean.empty:
+    values = pd.to_numeric(series, errors="coerce").to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    if not valid.any():
         return pd.Series(dtype="object")
 
-    min_val = float(clean.min())
-    max_val = float(clean.max())
+    min_val = float(values[valid].min())
+    max_val = float(values[valid].max())
     if min_val == max_val:
-        edges = [min_val - width / 2, max_val + width / 2]
+        start = min_val - width / 2
+        n_bins = 1
     else:
         start = floor(min_val / width) * width
         end = ceil(max_val / width) * width
         if start == end:
             end = start + width
-        steps = int(round((end - start) / width))
-        edges = [start + i * width for i in range(steps + 1)]
-        if edges[-1] < max_val:
-            edges.append(edges[-1] + width)
-
-    bins = pd.cut(series, bins=edges, include_lowest=True, right=False)
-    labels = bins.cat.categories
-    label_map = {
-        interval: f"{interval.left:.1f} to {interval.right:.1f}" for interval in labels
-    }
-    return bins.map(label_map)
+        n_bins = max(1, int(round((end - start) / width)))
+
+    codes = np.clip(np.floor((values - start) / width), 0, n_bins - 1)
+    codes = np.where(valid, codes, -1).astype(np.int32)
+    labels = [
+        f"{start + i * width:.1f} to {start + (i + 1) * width:.1f}" for i in range(n_bins)
+    ]
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=labels),
+        index=series.index,
+        name=series.name,
+    )
 
 
 st.set_page_config(page_title="Crypto vs US Yields", layout="wide")
@@ -90,10 +193,8 @@ if not DATA_PATH.exists():
     st.error(f"Missing data file: {DATA_PATH}")
     st.stop()
 
-df = pd.read_parquet(DATA_PATH)
-if "date" in df.columns:
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
-df = df.sort_values("date")
+data_mtime = DATA_PATH.stat().st_mtime
+df, df_by_date = load_rates(DATA_PATH, data_mtime)
 
 controls = st.columns(4)
 with controls[0]:
@@ -111,10 +212,8 @@ aave_col = f"aave_{rate_type}_apy"
 yield_col = f"yield_{tenor}"
 spread_col = f"{rate_type}_minus_yield_{tenor}"
 
-rates_df = df.set_index("date")[[aave_col, yield_col, spread_col]].copy()
-rates_df[spread_col] = (
-    rates_df[spread_col].rolling(window=ma_window, min_periods=1).mean()
-)
+rates_df = df_by_date[[aave_col, yield_col, spread_col]].copy()
+rates_df[spread_col] = rolling_mean(rates_df[spread_col], data_mtime, spread_col, ma_window)
 plot_df = rates_df.copy()
 plot_df = plot_df.rename(
     columns={
@@ -124,10 +223,7 @@ plot_df = plot_df.rename(
     }
 ).dropna(how="all")
 
-long_df = plot_df.reset_index().melt(
-    id_vars="date", var_name="series", value_name="value"
-)
-long_df = long_df.dropna(subset=["value"])
+long_df = melt_plot_frame(plot_df, data_mtime, rate_type, tenor, ma_window)
 
 selection = alt.selection_multi(fields=["series"], bind="legend")
 
@@ -242,7 +338,13 @@ else:
                 order = sorted(
                     distribution_df["spread_bin"].dropna().unique(), key=bin_sort_key
                 )
-                bin_median = distribution_df.groupby("spread_bin")["forward_return"].median()
+                win_table = summarize_bins(
+                    distribution_df["spread_bin"], distribution_df["forward_return"]
+                )
+                win_table = win_table.sort_values(
+                    "spread_bin", key=lambda col: col.map(bin_sort_key)
+                )
+                bin_median = win_table.set_index("spread_bin")["median"]
                 distribution_df = distribution_df.assign(
                     bin_color=distribution_df["spread_bin"].map(
                         lambda label: "#2E7D32" if bin_median.get(label, 0) > 0 else "#C62828"
@@ -277,21 +379,6 @@ else:
                     ticks=alt.MarkConfig(color="#FFFFFF"),
                 )
 
-                win_table = (
-                    distribution_df.groupby("spread_bin")["forward_return"]
-                    .agg(
-                        median="median",
-                        p25=lambda s: s.quantile(0.25),
-                        p75=lambda s: s.quantile(0.75),
-                        win_rate=lambda s: (s > 0).mean(),
-                        count="count",
-                    )
-                    .reset_index()
-                )
-                win_table = win_table.sort_values(
-                    "spread_bin", key=lambda col: col.map(bin_sort_key)
-                )
-
                 st.altair_chart(box, use_container_width=True)
                 st.caption("Summary stats per bin (returns in decimal form).")
                 st.dataframe(win_table, use_container_width=True)